@@ -2,6 +2,7 @@
 
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
+import anyio
 import uvicorn
 import sys
 import os
@@ -9,7 +10,10 @@ import os
 # Import your flashcard generation logic
 # Assuming flashcard_generator.py is in the same directory
 try:
-    from flashcard_generator import generate_mcq_flashcards
+    from flashcard_generator import (
+        get_nlp, generate_mcq_flashcards, generate_mcq_flashcards_batch, validate_text, TextValidationError,
+        MAX_BATCH_CHARS,
+    )
     # You might need to adjust the path or structure if flashcard_generator.py is moved
 except ImportError:
     print("Error: flashcard_generator.py not found or has errors.")
@@ -21,19 +25,73 @@ app = FastAPI(
     description="API for generating AI-powered flashcards from text."
 )
 
+@app.on_event("startup")
+def warm_up_nlp():
+    """Loads the spaCy model (and checks NLTK data) in each worker so the first request isn't slow."""
+    get_nlp()
+
+# spaCy parsing is CPU-bound and blocks, so it runs in worker threads instead of the event loop.
+# The limiter caps concurrent parses per process. All worker processes share the same cores,
+# so the CPU count is divided by the number of workers (API_WORKERS, which `python api_server.py`
+# sets for its workers; 1 if unset, e.g. under plain `uvicorn api_server:app`).
+# NLP_THREADS overrides the per-process cap directly.
+# The limiter is created on first use, inside the running event loop, since older anyio
+# versions can't create one at import time.
+_nlp_limiter = None
+
+def get_nlp_limiter():
+    global _nlp_limiter
+    if _nlp_limiter is None:
+        workers = max(1, int(os.getenv("API_WORKERS", "1")))
+        threads = int(os.getenv("NLP_THREADS", max(1, (os.cpu_count() or 1) // workers)))
+        _nlp_limiter = anyio.CapacityLimiter(threads)
+    return _nlp_limiter
+
 class TextInput(BaseModel):
     text: str
 
+class TextBatchInput(BaseModel):
+    texts: list[str]
+
+class Flashcard(BaseModel):
+    type: str
+    question: str
+    answer: str
+    options: list[str]
+
+# Upper limit on texts per batch request, so one call can't hold a worker for too long
+MAX_BATCH_TEXTS = 64
+
+def validate_single(text):
+    """Raises HTTPException if text can't be processed (see flashcard_generator.validate_text)."""
+    try:
+        validate_text(text)
+    except TextValidationError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+def validate_batch(texts):
+    """Raises HTTPException if a batch of texts is empty, too large or has an invalid text."""
+    if not texts:
+        raise HTTPException(status_code=400, detail="No texts provided.")
+    if len(texts) > MAX_BATCH_TEXTS:
+        raise HTTPException(status_code=400, detail=f"Too many texts: at most {MAX_BATCH_TEXTS} per request.")
+    for i, text in enumerate(texts):
+        try:
+            validate_text(text)
+        except TextValidationError as e:
+            raise HTTPException(status_code=e.status_code, detail=f"Text at index {i}: {e}")
+    if sum(len(text) for text in texts) > MAX_BATCH_CHARS:
+        raise HTTPException(status_code=413, detail=f"Texts are too long in total (max {MAX_BATCH_CHARS} characters per request).")
+
 @app.post("/generate_flashcards/")
 async def create_flashcards(data: TextInput):
     """
     Generates MCQ flashcards from the provided text.
     """
-    if not data.text or len(data.text) < 50: # Basic validation
-        raise HTTPException(status_code=400, detail="Input text is too short or empty.")
+    validate_single(data.text)
 
     try:
-        flashcards = generate_mcq_flashcards(data.text)
+        flashcards = await anyio.to_thread.run_sync(generate_mcq_flashcards, data.text, limiter=get_nlp_limiter())
         if not flashcards:
             # If no flashcards were generated but text was valid
             return {"message": "No flashcards could be generated from the provided text. Try a different text.", "flashcards": []}
@@ -42,15 +100,58 @@ async def create_flashcards(data: TextInput):
         # Catch any errors during flashcard generation
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.post("/generate_flashcards_batch/")
+async def create_flashcards_batch(data: TextBatchInput):
+    """
+    Generates MCQ flashcards for several texts in one call.
+    The texts are parsed together with spaCy's nlp.pipe, which is faster than one text at a time.
+    """
+    validate_batch(data.texts)
+
+    try:
+        results = await anyio.to_thread.run_sync(generate_mcq_flashcards_batch, data.texts, limiter=get_nlp_limiter())
+        return {"results": [{"flashcards": flashcards} for flashcards in results]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@app.post("/generate_flashcards_multi/", response_model=list[list[Flashcard]])
+async def create_flashcards_multi(data: TextBatchInput):
+    """
+    Generates MCQ flashcards for up to MAX_BATCH_TEXTS texts in one HTTP call.
+    Returns a plain list with one list of flashcards per input text, in input order.
+    """
+    validate_batch(data.texts)
+
+    try:
+        return await anyio.to_thread.run_sync(generate_mcq_flashcards_batch, data.texts, limiter=get_nlp_limiter())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
 # To run this file: uvicorn api_server:app --reload
 # --reload enables auto-reloading on code changes (useful for development)
 # --host 0.0.0.0 makes it accessible from other devices on your local network
 # if you are testing from a physical phone. For emulator, localhost is fine.
+#
+# spaCy parsing is CPU-bound, so a single process tops out at about one core.
+# Running `python api_server.py` starts several worker processes instead.
+# Each worker loads its own copy of the spaCy model, so memory grows with the
+# worker count; set API_WORKERS to tune it. The classic gunicorn heuristic is
+# 2 * cores + 1 workers, but for CPU-bound work cores - 1 is a safer default.
+# For production, gunicorn with uvicorn workers is also an option:
+#   gunicorn api_server:app -k uvicorn.workers.UvicornWorker -w 4 -b 0.0.0.0:8000
+# Set FLASHCARD_SERVER=litserve to run serve_lit.py instead, which batches concurrent
+# single-text requests into one nlp.pipe call.
 
 if __name__ == "__main__":
-    # This block is for running the API server directly from this file.
-    # For production, you'd use a process manager like Gunicorn or PM2.
-    # For local development, running it via uvicorn command is better.
-    print("To run the API server, use the command:")
-    print("uvicorn api_server:app --reload --host 0.0.0.0 --port 8000")
-    print("Make sure your virtual environment is activated.")
\ No newline at end of file
+    if os.getenv("FLASHCARD_SERVER") == "litserve":
+        # Opt-in LitServe server with automatic request batching (see serve_lit.py)
+        import serve_lit
+        serve_lit.main()
+    elif "--reload" in sys.argv:
+        # Reload mode only supports a single process
+        uvicorn.run("api_server:app", host="0.0.0.0", port=8000, reload=True)
+    else:
+        workers = int(os.getenv("API_WORKERS", max(1, (os.cpu_count() or 1) - 1)))
+        print(f"Starting API server with {workers} worker(s) on port 8000...")
+        os.environ["API_WORKERS"] = str(workers) # Read by each worker to size its nlp limiter
+        uvicorn.run("api_server:app", host="0.0.0.0", port=8000, workers=workers)
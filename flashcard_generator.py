@@ -1,14 +1,29 @@
 # flashcard_generator.py
 
+import os # Import os for checking file existence
+
+# BLIS (the matrix library behind spaCy's CPU models) must be configured before spaCy is imported.
+# Parallelism already comes from API workers and request threads, so default to one BLIS thread
+# each to avoid oversubscribing cores. Override with BLIS_NUM_THREADS.
+os.environ.setdefault("BLIS_NUM_THREADS", "1")
+
 import spacy
+from spacy.tokens import Doc
 import random
+import hashlib
+import functools
+import itertools
+import threading
+from collections import OrderedDict
 from nltk.corpus import wordnet
 import nltk
-import os # Import os for checking file existence
+import sys
+import contextlib
 
 # --- NLTK Data Check (Important for script execution) ---
-# It's better to check if the data is already present on the disk
-# rather than relying solely on exceptions which can be broad.
+# The check (and any downloads) runs from ensure_nltk() the first time the spaCy
+# model is needed (see get_nlp), instead of on every import of this module.
+# Set NLTK_READY=1 to skip it entirely when the data is known to be installed.
 
 # Define the NLTK data paths - typically found in ~/nltk_data or C:\nltk_data
 nltk_data_path = os.path.expanduser('~/nltk_data') # Common path on Linux/macOS
@@ -22,122 +37,325 @@ required_nltk_corpora = {
     'omw-1.4': 'corpora/omw-1.4'
 }
 
-for corp_name, corp_path in required_nltk_corpora.items():
-    # Construct potential full path to check for existence
-    full_corp_check_path = os.path.join(nltk_data_path, corp_path)
-    # NLTK stores data in subdirectories; checking for its existence is usually sufficient
-    # For example, 'wordnet' exists if '.../nltk_data/corpora/wordnet' directory is there
-    # For 'punkt' and 'averaged_perceptron_tagger', it's a bit different,
-    # but nltk.data.find is the most reliable way to check for NLTK's internal knowledge.
+@contextlib.contextmanager
+def _download_lock():
+    """File lock so several API workers starting together don't download the same data at once."""
     try:
-        nltk.data.find(corp_path) # Use the internal NLTK check
-    except LookupError: # This is the more general error for data not found in NLTK
-        print(f"NLTK '{corp_name}' ({corp_path}) not found. Downloading...")
+        import fcntl
+    except ImportError: # Not available on Windows; run without the lock
+        yield
+        return
+    os.makedirs(nltk_data_path, exist_ok=True)
+    with open(os.path.join(nltk_data_path, '.flashcard_download.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _missing_nltk_corpora():
+    """Returns the names of required NLTK corpora that nltk.data.find can't locate."""
+    missing = []
+    for corp_name, corp_path in required_nltk_corpora.items():
         try:
-            nltk.download(corp_name)
-        except Exception as e: # Catch a more general exception for robustness during download
-            print(f"Error downloading {corp_name}: {e}")
-            print(f"Please try running 'python -m nltk.downloader {corp_name}' in your terminal (with venv activated).")
-            # You might want to exit or raise a more specific error here if essential data is missing
+            nltk.data.find(corp_path) # Use the internal NLTK check
+        except LookupError: # This is the more general error for data not found in NLTK
+            missing.append(corp_name)
+    return missing
+
+def ensure_nltk():
+    """Makes sure the required NLTK data is available, downloading anything missing."""
+    if os.getenv('NLTK_READY') == '1':
+        return
+    # Check without the lock first: it writes to the data directory, which may be read-only
+    # when the data is already installed (e.g. in /usr/share/nltk_data)
+    if not _missing_nltk_corpora():
+        return
+    with _download_lock():
+        for corp_name in _missing_nltk_corpora(): # Another worker may have downloaded some meanwhile
+            print(f"NLTK '{corp_name}' ({required_nltk_corpora[corp_name]}) not found. Downloading...")
+            try:
+                nltk.download(corp_name)
+            except Exception as e: # Catch a more general exception for robustness during download
+                print(f"Error downloading {corp_name}: {e}")
+                print(f"Please try running 'python -m nltk.downloader {corp_name}' in your terminal (with venv activated).")
 # --- End NLTK Data Check ---
 
 
-# Load the English language model for spaCy
-try:
-    nlp = spacy.load("en_core_web_sm")
-    print("spaCy model loaded successfully!")
-except OSError:
-    print("spaCy model 'en_core_web_sm' not found. Downloading...")
-    # This might require administrator privileges or be run directly in terminal
-    # Use python -m spacy download en_core_web_sm in your activated venv
+# English language model for spaCy, loaded lazily by get_nlp() on first use
+# SPACY_MODEL picks the pipeline. en_core_web_sm is the default: it is the fastest of the
+# standard English models on CPU. Larger ones (en_core_web_md/lg) are slower but more
+# accurate; any replacement must still provide a parser, tagger and NER.
+SPACY_MODEL = os.getenv("SPACY_MODEL", "en_core_web_sm")
+# Lemmas are never used, so the lemmatizer is disabled to save time per text.
+# The attribute_ruler must stay enabled: it fills token.pos_, which noun_chunks
+# and the distractor fallback rely on.
+SPACY_DISABLED_PIPES = ["lemmatizer"]
+_nlp = None
+_nlp_lock = threading.Lock()
+
+def get_nlp():
+    """Returns the shared spaCy model, loading it (and NLTK's WordNet) on first call."""
+    global _nlp
+    if _nlp is not None:
+        return _nlp
+    with _nlp_lock: # Several request threads may ask for the model at once
+        if _nlp is None:
+            ensure_nltk()
+            # WordNet's lazy loader isn't thread-safe on first use, so load it here,
+            # before request threads call get_synonyms concurrently
+            wordnet.ensure_loaded()
+            _nlp = _load_spacy_model()
+    return _nlp
+
+def _load_spacy_model():
+    spacy.require_cpu() # Run on thinc's CPU ops; the pipeline is not GPU-bound
     try:
-        spacy.cli.download("en_core_web_sm")
-        nlp = spacy.load("en_core_web_sm")
-    except Exception as e:
-        print(f"Error downloading spaCy model: {e}")
-        print("Please ensure your virtual environment is activated and run 'python -m spacy download en_core_web_sm' manually.")
-        print("Exiting as essential model could not be loaded.")
-        exit() # Exit if essential model cannot be loaded
-
-
-def get_synonyms(word):
-    """Fetches synonyms for a word using WordNet."""
-    synonyms = set()
+        nlp = spacy.load(SPACY_MODEL, disable=SPACY_DISABLED_PIPES)
+        print("spaCy model loaded successfully!")
+    except OSError:
+        print(f"spaCy model '{SPACY_MODEL}' not found. Downloading...")
+        # This might require administrator privileges or be run directly in terminal
+        # Use python -m spacy download <model name> in your activated venv
+        try:
+            with _download_lock():
+                try: # Another worker may have finished the download while we waited
+                    nlp = spacy.load(SPACY_MODEL, disable=SPACY_DISABLED_PIPES)
+                except OSError:
+                    spacy.cli.download(SPACY_MODEL)
+                    nlp = spacy.load(SPACY_MODEL, disable=SPACY_DISABLED_PIPES)
+        except Exception as e:
+            print(f"Error downloading spaCy model: {e}")
+            print(f"Please ensure your virtual environment is activated and run 'python -m spacy download {SPACY_MODEL}' manually.")
+            print("Exiting as essential model could not be loaded.")
+            sys.exit(1) # Exit if essential model cannot be loaded
+    return nlp
+
+
+# Entity types that make good flashcard answers
+_ANSWER_ENT_LABELS = frozenset({
+    "GPE", "LOC", "ORG", "PERSON", "NORP", "FAC", "PRODUCT", "EVENT", "WORK_OF_ART",
+    "LAW", "LANGUAGE", "PERCENT", "MONEY", "QUANTITY", "ORDINAL",
+})
+
+# Words that never give useful synonym distractors
+STOPWORDS = frozenset({
+    "the", "and", "for", "are", "but", "not", "you", "all", "any", "can", "her", "was",
+    "one", "our", "out", "has", "him", "his", "how", "its", "who", "did", "yes", "this",
+    "that", "with", "have", "from", "they", "them", "then", "than", "what", "when",
+    "were", "will", "which", "there", "their", "these", "those", "some",
+})
+
+def iter_synonyms(word):
+    """Yields WordNet synonyms for a word one at a time, skipping the word itself and repeats.
+    Lets callers stop early instead of walking every synset and lemma."""
+    word_lower = word.lower()
+    seen = set()
     for syn in wordnet.synsets(word):
         for lemma in syn.lemmas():
             synonym = lemma.name().replace("_", " ")
-            if synonym.lower() != word.lower(): # Avoid adding the word itself
-                synonyms.add(synonym)
-    return list(synonyms)
+            synonym_lower = synonym.lower()
+            if synonym_lower != word_lower and synonym_lower not in seen: # Avoid adding the word itself
+                seen.add(synonym_lower)
+                yield synonym
+
+def get_synonyms(word, limit=None):
+    """Fetches up to limit synonyms (all if None) for a word using WordNet.
+    Returns a tuple; results are cached per lowercased word and limit."""
+    return _get_synonyms_cached(word.lower(), limit)
+
+@functools.lru_cache(maxsize=8192)
+def _get_synonyms_cached(word, limit):
+    if len(word) < 3 or word in STOPWORDS:
+        return ()
+    return tuple(itertools.islice(iter_synonyms(word), limit))
+
+# Number of texts spaCy processes per batch in nlp.pipe (override with env var)
+SPACY_BATCH_SIZE = int(os.getenv("FLASHCARD_SPACY_BATCH_SIZE", "32"))
+
+# Cache of parsed Docs, keyed by a hash of the input text.
+# Students often resubmit the same text, so re-parsing it can be skipped.
+# Docs are stored serialized (Doc.to_bytes) and rebuilt on a hit. The cache is bounded
+# both by entry count and by total serialized size, and a single Doc bigger than
+# 1/8 of the byte budget is not cached at all.
+DOC_CACHE_SIZE = int(os.getenv("FLASHCARD_DOC_CACHE_SIZE", "512"))
+DOC_CACHE_MAX_BYTES = int(os.getenv("FLASHCARD_DOC_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# tok2vec fills doc.tensor with ~384 bytes per token that nothing here reads, so it isn't stored
+_DOC_CACHE_EXCLUDE = ["tensor", "user_data"]
+_doc_cache = OrderedDict()
+_doc_cache_bytes = 0
+_doc_cache_lock = threading.Lock()
+
+def parse_text(text):
+    """Returns the spaCy Doc for text, reusing a cached parse when available."""
+    key = hashlib.blake2b(text.encode("utf-8")).hexdigest()
+    with _doc_cache_lock:
+        blob = _doc_cache.get(key)
+        if blob is not None:
+            _doc_cache.move_to_end(key) # Mark as most recently used
+    if blob is not None:
+        return Doc(get_nlp().vocab).from_bytes(blob)
+
+    doc = get_nlp()(text)
+    if DOC_CACHE_SIZE > 0:
+        blob = doc.to_bytes(exclude=_DOC_CACHE_EXCLUDE)
+        if len(blob) <= DOC_CACHE_MAX_BYTES // 8:
+            _cache_doc_bytes(key, blob)
+    return doc
+
+def _cache_doc_bytes(key, blob):
+    global _doc_cache_bytes
+    with _doc_cache_lock:
+        old_blob = _doc_cache.pop(key, None)
+        if old_blob is not None: # Another thread cached the same text meanwhile
+            _doc_cache_bytes -= len(old_blob)
+        _doc_cache[key] = blob
+        _doc_cache_bytes += len(blob)
+        while len(_doc_cache) > DOC_CACHE_SIZE or _doc_cache_bytes > DOC_CACHE_MAX_BYTES:
+            _, evicted = _doc_cache.popitem(last=False) # Evict the least recently used entry
+            _doc_cache_bytes -= len(evicted)
+
+# Input length limits shared by api_server.py and serve_lit.py
+MIN_CHARS = 50
+# Longer inputs are rejected before parsing, so one request can't hold a worker for minutes
+MAX_CHARS = 200_000
+# Upper limit on the combined length of texts parsed together in one batch
+MAX_BATCH_CHARS = 1_000_000
+
+class TextValidationError(ValueError):
+    """Raised by validate_text for unusable input; status_code is the HTTP status to return."""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def validate_text(text):
+    """Raises TextValidationError if text is empty, too short or too long to process."""
+    if not text or len(text) < MIN_CHARS:
+        raise TextValidationError("Input text is too short or empty.")
+    if len(text) > MAX_CHARS:
+        raise TextValidationError(f"Input text is too long (max {MAX_CHARS} characters).", status_code=413)
+
+# Texts longer than this are split into paragraphs and parsed with nlp.pipe
+# rather than as one huge Doc
+LARGE_TEXT_CHARS = 50_000
+
+def _split_large_text(text):
+    """Returns the parts a text should be parsed as: itself, or its paragraphs if it's very long."""
+    if len(text) > LARGE_TEXT_CHARS:
+        return [p for p in text.split("\n\n") if p.strip()]
+    return [text]
+
+def text_to_docs(text):
+    """Parses a text into one Doc, or one Doc per paragraph (via nlp.pipe) if it's very long."""
+    parts = _split_large_text(text)
+    if len(parts) == 1 and parts[0] is text:
+        return [parse_text(text)]
+    return get_nlp().pipe(parts, batch_size=8)
 
 def generate_mcq_flashcards(doc_text, num_distractors=3):
+    """Generates MCQ flashcards from a single text."""
     flashcards = []
-    doc = nlp(doc_text) # Process the text again within the function
+    for doc in text_to_docs(doc_text):
+        flashcards.extend(generate_from_doc(doc, num_distractors))
+    return flashcards
+
+def generate_mcq_flashcards_batch(texts, num_distractors=3):
+    """Generates MCQ flashcards for many texts, parsing them together with nlp.pipe.
+    Very long texts are split into paragraphs first, like in generate_mcq_flashcards.
+    Returns one list of flashcards per input text, in the same order."""
+    owners = [] # Index of the input text each part came from
+    parts = []
+    for i, text in enumerate(texts):
+        for part in _split_large_text(text):
+            owners.append(i)
+            parts.append(part)
+
+    results = [[] for _ in texts]
+    docs = get_nlp().pipe(parts, batch_size=SPACY_BATCH_SIZE, n_process=1)
+    for owner, doc in zip(owners, docs):
+        results[owner].extend(generate_from_doc(doc, num_distractors))
+    return results
+
+# Module-level generator for option shuffling, independent of the global random state
+_rng = random.Random()
+
+# Sentences with fewer tokens than this are skipped without looking for an answer
+MIN_SENTENCE_TOKENS = 6
+
+def _distractor_candidates(synonyms, text_pool, max_pool_draws):
+    """Yields (text, lowercased text) distractor candidates: synonyms first, then entries from
+    the text pool at random positions (up to max_pool_draws distinct ones), without shuffling it."""
+    for synonym in synonyms:
+        yield synonym, synonym.lower()
+    for index in _rng.sample(range(len(text_pool)), min(len(text_pool), max_pool_draws)):
+        yield text_pool[index]
+
+def generate_from_doc(doc, num_distractors=3):
+    """Generates MCQ flashcards from an already parsed spaCy Doc."""
+    flashcards = []
+
+    # Fallback distractors from the text itself, collected once per Doc rather than per sentence.
+    # Deduplicated by lowercased text (first spelling wins), so random draws from the pool
+    # aren't wasted on repeats. Stored as (text, lowercased text) pairs.
+    pool_by_lower = {}
+    for other_ent in doc.ents: # Search whole doc for variety
+        if len(other_ent.text.split()) < 4: # Keep distractors concise
+            pool_by_lower.setdefault(other_ent.text.lower(), other_ent.text)
+    for token in doc: # Common nouns
+        if token.pos_ == 'NOUN' and len(token.text) > 2:
+            pool_by_lower.setdefault(token.lower_, token.text)
+    text_distractor_pool = [(text, text_lower) for text_lower, text in pool_by_lower.items()]
 
     for sent in doc.sents: # Iterate over each sentence
-        sentence = sent.text.strip()
-        if not sentence: # Skip empty sentences
+        # Cheap pre-screen: very short sentences, or ones without any capitalized word or entity,
+        # almost never yield a usable answer, so skip the entity/noun chunk scan for them
+        if len(sent) < MIN_SENTENCE_TOKENS or not any(t.is_title or t.ent_type_ for t in sent):
             continue
 
-        answer_candidate = None
+        answer_span = None
         # Priority 1: Named Entities (Nouns: GPE, LOC, ORG, PERSON)
         for ent in sent.ents:
-            if ent.label_ in ["GPE", "LOC", "ORG", "PERSON", "NORP", "FAC", "PRODUCT", "EVENT", "WORK_OF_ART", "LAW", "LANGUAGE", "PERCENT", "MONEY", "QUANTITY", "ORDINAL"]:
-                answer_candidate = ent.text
+            if ent.label_ in _ANSWER_ENT_LABELS:
+                answer_span = ent
                 break # Take the first suitable entity
 
         # Priority 2: Noun Chunks (for more general concepts)
-        if not answer_candidate:
+        if answer_span is None:
             for chunk in sent.noun_chunks:
                 # Ensure the chunk is reasonably long and not just a common pronoun
-                if len(chunk.text.split()) > 1 and len(chunk.text) > 5 and chunk.root.pos_ == 'NOUN':
-                    answer_candidate = chunk.text
+                # (token count and char offsets avoid building and splitting chunk.text)
+                if len(chunk) > 1 and chunk.end_char - chunk.start_char > 5 and chunk.root.pos_ == 'NOUN':
+                    answer_span = chunk
                     break
 
-        if not answer_candidate:
+        if answer_span is None:
             continue # No suitable answer found in this sentence
 
+        answer_candidate = answer_span.text
         # Ensure the candidate is not just whitespace or too short
         if not answer_candidate.strip() or len(answer_candidate.strip()) < 3:
             continue
 
-        question_text = sentence.replace(answer_candidate, "______", 1) # Create fill-in-the-blank question
-        # Basic check to avoid issues if the answer is a very common word that appears multiple times
-        # or if the replacement makes the question nonsensical
-        if answer_candidate.lower() in question_text.lower() and "______" not in question_text:
-            continue
+        # Create fill-in-the-blank question by cutting the answer out at its exact character offsets
+        answer_start = answer_span.start_char - sent.start_char
+        answer_end = answer_span.end_char - sent.start_char
+        question_text = sent.text[:answer_start] + "______" + sent.text[answer_end:]
 
 
         # Now, generate distractors for MCQ
         distractors = []
         # Use the last word if it's a phrase, otherwise the whole word
         target_word_for_synonym = answer_candidate.split()[-1] if ' ' in answer_candidate else answer_candidate
-        possible_distractors = get_synonyms(target_word_for_synonym)
-
-        # Fallback if not enough synonyms: Find other nouns/entities in the text
-        if len(possible_distractors) < num_distractors:
-             temp_distractors_from_text = []
-             # Collect all named entities (excluding the answer itself)
-             for other_ent in doc.ents: # Search whole doc for variety
-                 if other_ent.text.lower() != answer_candidate.lower() and len(other_ent.text.split()) < 4: # Keep distractors concise
-                     temp_distractors_from_text.append(other_ent.text)
-             # Collect common nouns (excluding the answer itself)
-             for token in doc:
-                 if token.pos_ == 'NOUN' and token.text.lower() != answer_candidate.lower() and len(token.text) > 2:
-                     temp_distractors_from_text.append(token.text)
-
-             random.shuffle(temp_distractors_from_text)
-             for d_text in temp_distractors_from_text:
-                 if d_text not in possible_distractors:
-                     possible_distractors.append(d_text)
-                     if len(possible_distractors) >= num_distractors * 2: # Get more than needed initially
-                         break
-
-
-        # Select unique distractors, ensuring they are not the answer itself
+        synonyms = get_synonyms(target_word_for_synonym, limit=num_distractors * 2) # Slack for dedup
+
+        # Single pass over synonyms, then other entities/nouns from the text as a fallback,
+        # skipping the answer and duplicates (case-insensitive) and stopping once we have enough
         final_distractors = []
-        for d in possible_distractors:
-            if d.lower() != answer_candidate.lower() and d.lower() not in [dist.lower() for dist in final_distractors]:
+        seen_lower = {answer_candidate.lower()} # Lowercased answer and distractors picked so far
+        # The pool has no repeats, so a few extra draws cover the answer and any synonym overlap
+        for d, d_lower in _distractor_candidates(synonyms, text_distractor_pool, num_distractors * 4):
+            if d_lower not in seen_lower:
+                seen_lower.add(d_lower)
                 final_distractors.append(d)
                 if len(final_distractors) >= num_distractors:
                     break
@@ -148,8 +366,8 @@ def generate_mcq_flashcards(doc_text, num_distractors=3):
 
 
         # Combine answer and selected distractors, then shuffle for options
-        options = [answer_candidate] + random.sample(final_distractors, min(len(final_distractors), num_distractors))
-        random.shuffle(options)
+        options = [answer_candidate, *final_distractors[:num_distractors]]
+        _rng.shuffle(options)
 
         flashcards.append({
             "type": "mcq",
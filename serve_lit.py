@@ -0,0 +1,80 @@
+# serve_lit.py
+
+# Alternative server entrypoint using LitServe, which batches concurrent requests automatically.
+# Requests that arrive within BATCH_TIMEOUT seconds of each other are grouped (up to
+# MAX_BATCH_SIZE) and parsed together with nlp.pipe, at most MAX_BATCH_CHARS characters per call.
+# Invalid texts get {"error": ..., "status_code": ...} back instead of flashcards.
+#
+# Install with: pip install litserve
+# Run with: python serve_lit.py  (or FLASHCARD_SERVER=litserve python api_server.py)
+# Then POST {"text": "..."} to http://localhost:8000/predict
+
+import os
+import sys
+
+try:
+    import litserve as ls
+except ImportError:
+    print("Error: litserve is not installed.")
+    print("Please run 'pip install litserve' (with venv activated) to use this server.")
+    sys.exit(1)
+
+from flashcard_generator import (
+    get_nlp, generate_mcq_flashcards_batch, validate_text, TextValidationError, MAX_BATCH_CHARS,
+)
+
+MAX_BATCH_SIZE = int(os.getenv("LITSERVE_MAX_BATCH_SIZE", "16"))
+BATCH_TIMEOUT = float(os.getenv("LITSERVE_BATCH_TIMEOUT", "0.05"))
+
+class FlashcardAPI(ls.LitAPI):
+    # LitServe decodes a whole batch inside one try block, so raising HTTPException for one
+    # bad request would fail every request batched with it. Invalid input is instead passed
+    # through as a TextValidationError and turned into an error response for that request only.
+
+    def setup(self, device):
+        get_nlp() # Load the model before serving requests
+
+    def decode_request(self, request):
+        text = request.get("text")
+        try:
+            validate_text(text) # Same validation as api_server
+        except TextValidationError as e:
+            return e
+        return text
+
+    def predict(self, batch):
+        # batch holds texts and TextValidationErrors; returns one result per item, in order
+        results = list(batch)
+        valid = [i for i, item in enumerate(batch) if not isinstance(item, TextValidationError)]
+        for group in _group_by_chars(valid, batch):
+            for i, flashcards in zip(group, generate_mcq_flashcards_batch([batch[i] for i in group])):
+                results[i] = flashcards
+        return results
+
+    def encode_response(self, output):
+        if isinstance(output, TextValidationError):
+            return {"error": str(output), "status_code": output.status_code}
+        return {"flashcards": output}
+
+def _group_by_chars(indices, texts):
+    """Splits indices into groups whose texts add up to at most MAX_BATCH_CHARS characters,
+    so one coalesced batch never goes through nlp.pipe as a single oversized call."""
+    group = []
+    group_chars = 0
+    for i in indices:
+        if group and group_chars + len(texts[i]) > MAX_BATCH_CHARS:
+            yield group
+            group = []
+            group_chars = 0
+        group.append(i)
+        group_chars += len(texts[i])
+    if group:
+        yield group
+
+def main():
+    api = FlashcardAPI(max_batch_size=MAX_BATCH_SIZE, batch_timeout=BATCH_TIMEOUT)
+    server = ls.LitServer(api)
+    server.run(port=8000)
+
+if __name__ == "__main__":
+    main()